@@ -1,18 +1,27 @@
+import asyncio
 import logging
 import os
 from pathlib import Path
 
+import aiohttp
 from aiohttp import web
 from azure.core.credentials import AzureKeyCredential
 from azure.identity import AzureDeveloperCliCredential, DefaultAzureCredential
 from dotenv import load_dotenv
 
-from ragtools import attach_rag_tools
+from ragtools import SemanticCache, attach_rag_tools, azure_openai_embedder
 from rtmt import RTMiddleTier
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("voicerag")
 
+# Run on libuv when available (not on Windows), the proxy loop is dominated by socket I/O
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 async def create_app():
     if not os.environ.get("RUNNING_IN_PRODUCTION"):
         logger.info("Running in development mode, loading from .env file")
@@ -38,12 +47,44 @@ async def create_app():
     # Initialize App with aiohttp
     app = web.Application()
 
+    # Share one keep-alive session to Azure OpenAI across all HTTP calls (e.g. embeddings)
+    aoai_session = aiohttp.ClientSession(
+        base_url=os.environ["AZURE_OPENAI_ENDPOINT"],
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=32, keepalive_timeout=60, ttl_dns_cache=300)
+        )
+    app["aoai_session"] = aoai_session
+    # Realtime websockets hold their connection for the whole conversation, so they get their own
+    # unlimited connector instead of using up (and queueing behind) the HTTP connection slots
+    realtime_session = aiohttp.ClientSession(
+        base_url=os.environ["AZURE_OPENAI_ENDPOINT"],
+        connector=aiohttp.TCPConnector(limit=0, ttl_dns_cache=300)
+        )
+    app["realtime_session"] = realtime_session
+
+    async def warm_up_aoai_session(app):
+        # Open a connection before the first client arrives so it doesn't pay DNS + TCP + TLS setup
+        try:
+            # Bounded, an unreachable endpoint must not hold up startup for the default 5 minutes
+            async with app["aoai_session"].head("/", timeout=aiohttp.ClientTimeout(total=5)):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.warning("Could not warm up the Azure OpenAI connection", exc_info=True)
+
+    async def close_aoai_sessions(app):
+        await app["aoai_session"].close()
+        await app["realtime_session"].close()
+
+    app.on_startup.append(warm_up_aoai_session)
+
     # Define custom a middlwere
     rtmt = RTMiddleTier(
         credentials=llm_credential,
         endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
         deployment=os.environ["AZURE_OPENAI_REALTIME_DEPLOYMENT"],
-        voice_choice=os.environ.get("AZURE_OPENAI_REALTIME_VOICE_CHOICE") or "alloy"
+        voice_choice=os.environ.get("AZURE_OPENAI_REALTIME_VOICE_CHOICE") or "alloy",
+        session=realtime_session,
+        tool_concurrency=int(os.environ.get("TOOL_CONCURRENCY") or 16),
+        tool_timeout=float(os.environ.get("TOOL_TIMEOUT") or 8)
         )
     rtmt.system_message = "You are a helpful assistant. Only answer questions based on information you searched in the knowledge base, accessible with the 'search' tool. " + \
                           "The user is listening to answers with audio, so it's *super* important that answers are as short as possible, a single sentence if at all possible. " + \
@@ -52,6 +93,19 @@ async def create_app():
                           "1. Always use the 'search' tool to check the knowledge base before answering a question. \n" + \
                           "2. Always use the 'report_grounding' tool to report the source of information from the knowledge base. \n" + \
                           "3. Produce an answer that's as short as possible. If the answer isn't in the knowledge base, say you don't know."
+    # Cache search results by query similarity, opt-in only: documents that differ by a single name (e.g. two plans)
+    # can produce near-identical queries, so the threshold has to be chosen for the corpus and embedding model
+    semantic_cache = None
+    cache_threshold = os.environ.get("SEMANTIC_CACHE_THRESHOLD")
+    embedding_deployment = os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    if cache_threshold and embedding_deployment:
+        logger.info("Using semantic cache with embedding deployment %s and threshold %s", embedding_deployment, cache_threshold)
+        semantic_cache = SemanticCache(
+            embed=azure_openai_embedder(os.environ["AZURE_OPENAI_ENDPOINT"], embedding_deployment, rtmt.auth_headers, session=aoai_session),
+            threshold=float(cache_threshold),
+            max_size=int(os.environ.get("SEMANTIC_CACHE_MAX_SIZE") or 10000)
+            )
+
     # Define tool to use in function call 
     attach_rag_tools(rtmt,
         credentials=search_credential,
@@ -62,11 +116,14 @@ async def create_app():
         content_field=os.environ.get("AZURE_SEARCH_CONTENT_FIELD") or "chunk",
         embedding_field=os.environ.get("AZURE_SEARCH_EMBEDDING_FIELD") or "text_vector",
         title_field=os.environ.get("AZURE_SEARCH_TITLE_FIELD") or "title",
-        use_vector_query=(os.environ.get("AZURE_SEARCH_USE_VECTOR_QUERY") == "true") or True
+        use_vector_query=(os.environ.get("AZURE_SEARCH_USE_VECTOR_QUERY") == "true") or True,
+        semantic_cache=semantic_cache
         )
 
     # When the App recieve a GET on "/realtime" invokes the rtmt _websoket_handler function
     rtmt.attach_to_app(app, "/realtime")
+    # Close the sessions after the middle tier has closed its pooled connections
+    app.on_cleanup.append(close_aoai_sessions)
 
     # Handle App routing serving 'static/index.html' as deafault landing page
     current_directory = Path(__file__).parent
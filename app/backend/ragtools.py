@@ -1,6 +1,14 @@
+import asyncio
+import contextlib
+import logging
 import re
-from typing import Any
+from collections import OrderedDict
+from collections.abc import Awaitable
+from typing import Any, Callable, Optional
 
+import aiohttp
+import faiss
+import numpy as np
 from azure.core.credentials import AzureKeyCredential
 from azure.identity import DefaultAzureCredential
 from azure.search.documents.aio import SearchClient
@@ -8,6 +16,8 @@ from azure.search.documents.models import VectorizableTextQuery
 
 from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
 
+logger = logging.getLogger("voicerag")
+
 _search_tool_schema = {
     "type": "function",
     "name": "search",
@@ -49,51 +59,206 @@ _grounding_tool_schema = {
     }
 }
 
-async def _search_tool(
+class SemanticCache:
+    """In-memory cache of search results, looked up by cosine similarity of the query embeddings"""
+
+    def __init__(self, embed: Callable[[str], Awaitable[list[float]]], threshold: float = 0.95, max_size: int = 10000):
+        """Initialize an empty cache
+        Args:
+            embed (Callable[[str], Awaitable[list[float]]]): Async function returning the embedding of a query
+
+            threshold (float): Minimum cosine similarity for a cached query to be considered a hit. Queries that only
+                differ by a name (e.g. "Northwind Standard" vs "Northwind Health Plus") can score very close to 1,
+                so keep it high and check it against your own corpus and embedding model
+
+            max_size (int): Maximum number of cached entries, the least recently used ones are evicted first
+        """
+        self.embed = embed
+        self.threshold = threshold
+        self.max_size = max_size
+        self._index: Optional[faiss.IndexIDMap] = None # Created on first insert, once the embedding size is known
+        self._entries: OrderedDict[int, tuple[str, str]] = OrderedDict() # { id : (query, result text) } in LRU order
+        self._next_id = 0
+        self._lock = asyncio.Lock()
+
+    async def vectorize(self, query: str) -> np.ndarray:
+        vector = np.array([await self.embed(query)], dtype=np.float32)
+        faiss.normalize_L2(vector) # Inner product of normalized vectors is the cosine similarity
+        return vector
+
+    def _nearest(self, vector: np.ndarray) -> tuple[float, int]:
+        scores, ids = self._index.search(vector, 1)
+        return float(scores[0][0]), int(ids[0][0])
+
+    async def lookup(self, vector: np.ndarray) -> Optional[str]:
+        async with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return None
+            score, entry_id = await asyncio.get_running_loop().run_in_executor(None, self._nearest, vector)
+            if entry_id < 0 or score < self.threshold:
+                return None
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id][1]
+
+    def _replace(self, evicted: Optional[int], vector: np.ndarray, entry_id: int) -> None:
+        # remove_ids compacts the whole flat index, so this runs in a worker thread
+        if evicted is not None:
+            self._index.remove_ids(np.array([evicted], dtype=np.int64))
+        self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+
+    async def store(self, query: str, vector: np.ndarray, text: str) -> None:
+        async with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap(faiss.IndexFlatIP(vector.shape[1]))
+            evicted = None
+            if len(self._entries) >= self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+            await asyncio.get_running_loop().run_in_executor(None, self._replace, evicted, vector, self._next_id)
+            self._entries[self._next_id] = (query, text)
+            self._next_id += 1
+
+def azure_openai_embedder(
+    endpoint: str,
+    deployment: str,
+    get_headers: Callable[[], dict[str, str]],
+    api_version: str = "2024-06-01",
+    session: Optional[aiohttp.ClientSession] = None
+    ) -> Callable[[str], Awaitable[list[float]]]:
+    # Authentication comes from the caller (e.g. RTMiddleTier.auth_headers) so the cached token is
+    # reused instead of fetching one on the event loop for every query
+    async def embed(text: str) -> list[float]:
+        # Reuse the shared session when available, its connections to the endpoint are kept alive
+        async with (contextlib.nullcontext(session) if session is not None else aiohttp.ClientSession(base_url=endpoint)) as embed_session:
+            async with embed_session.post(f"/openai/deployments/{deployment}/embeddings",
+                                          params={ "api-version": api_version },
+                                          headers=get_headers(),
+                                          json={ "input": text },
+                                          timeout=aiohttp.ClientTimeout(total=5, connect=1)) as response:
+                response.raise_for_status()
+                body = await response.json()
+        return body["data"][0]["embedding"]
+
+    return embed
+
+# Keep references to fire-and-forget tasks so they aren't garbage collected before completing
+_background_tasks: set[asyncio.Task] = set()
+
+# Searches currently running, keyed by normalized query, so concurrent duplicates await the same result
+_inflight: dict[str, asyncio.Future] = {}
+
+def _on_store_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    # Nobody awaits the store, so surface its failure here instead of losing it
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Semantic cache store failed", exc_info=task.exception())
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+async def _search(
     search_client: SearchClient, 
     semantic_configuration: str,
     identifier_field: str,
     content_field: str,
+    select: str,
     embedding_field: str,
     use_vector_query: bool,
-    args: Any) -> ToolResult:
-    print(f"Searching for '{args['query']}' in the knowledge base.")
+    semantic_cache: Optional[SemanticCache],
+    query: str) -> str:
+    # Serve semantically equivalent queries from the cache, skipping the search round-trip
+    query_vector = None
+    if semantic_cache is not None:
+        try:
+            query_vector = await semantic_cache.vectorize(query)
+            cached = await semantic_cache.lookup(query_vector)
+            if cached is not None:
+                return cached
+        except Exception:
+            logger.warning("Semantic cache lookup failed, falling back to search", exc_info=True)
     # Hybrid + Reranking query using Azure AI Search
     vector_queries = []
     if use_vector_query:
-        vector_queries.append(VectorizableTextQuery(text=args['query'], k_nearest_neighbors=50, fields=embedding_field))
+        vector_queries.append(VectorizableTextQuery(text=query, k_nearest_neighbors=50, fields=embedding_field))
     search_results = await search_client.search(
-        search_text=args['query'], 
+        search_text=query, 
         query_type="semantic",
         semantic_configuration_name=semantic_configuration,
         top=5,
         vector_queries=vector_queries,
-        select=", ".join([identifier_field, content_field])
+        select=select
     )
-    result = ""
+    # Collect the formatted chunks and join once, rather than re-copying the growing string per result
+    chunks = []
     async for r in search_results:
-        result += f"[{r[identifier_field]}]: {r[content_field]}\n-----\n"
+        chunks.append(f"[{r[identifier_field]}]: {r[content_field]}\n-----\n")
+    result = "".join(chunks)
+    if query_vector is not None and result:
+        # Index the result in the background, the caller only needs the text
+        task = asyncio.create_task(semantic_cache.store(query, query_vector, result))
+        _background_tasks.add(task)
+        task.add_done_callback(_on_store_done)
+    return result
+
+async def _search_tool(
+    search_client: SearchClient, 
+    semantic_configuration: str,
+    identifier_field: str,
+    content_field: str,
+    select: str,
+    embedding_field: str,
+    use_vector_query: bool,
+    semantic_cache: Optional[SemanticCache],
+    args: Any) -> ToolResult:
+    logger.debug("Searching for '%s' in the knowledge base.", args['query'])
+    # Coalesce with an identical search already in flight instead of issuing a new one
+    key = _normalize_query(args['query'])
+    while key in _inflight:
+        shared = _inflight[key]
+        try:
+            # Shield the shared future so a cancelled waiter doesn't cancel it for everyone else
+            return ToolResult(await asyncio.shield(shared), ToolResultDirection.TO_SERVER)
+        except asyncio.CancelledError:
+            # Only swallow the cancellation of the search we were waiting on (e.g. its caller timed out)
+            if not shared.cancelled():
+                raise
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await _search(search_client, semantic_configuration, identifier_field, content_field, select, embedding_field, use_vector_query, semantic_cache, args['query'])
+        future.set_result(result)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # Mark as retrieved, it is re-raised below and by any waiter
+        raise
+    finally:
+        _inflight.pop(key, None)
     return ToolResult(result, ToolResultDirection.TO_SERVER)
 
 KEY_PATTERN = re.compile(r'^[a-zA-Z0-9_=\-]+$')
 
 # TODO: move from sending all chunks used for grounding eagerly to only sending links to 
 # the original content in storage, it'll be more efficient overall
-async def _report_grounding_tool(search_client: SearchClient, identifier_field: str, title_field: str, content_field: str, args: Any) -> None:
-    sources = [s for s in args["sources"] if KEY_PATTERN.match(s)]
-    list = " OR ".join(sources)
-    print(f"Grounding source: {list}")
+async def _report_grounding_tool(search_client: SearchClient, identifier_field: str, title_field: str, content_field: str, select: list[str], args: Any) -> ToolResult:
+    # Drop invalid and repeated keys so top matches the number of distinct sources searched
+    sources = list(dict.fromkeys(s for s in args["sources"] if KEY_PATTERN.match(s)))
+    if not sources:
+        return ToolResult({"sources": []}, ToolResultDirection.TO_CLIENT)
+    search_text = " OR ".join(sources)
+    logger.debug("Grounding source: %s", search_text)
     # Use search instead of filter to align with how detailt integrated vectorization indexes
     # are generated, where chunk_id is searchable with a keyword tokenizer, not filterable 
-    search_results = await search_client.search(search_text=list, 
+    search_results = await search_client.search(search_text=search_text, 
                                                 search_fields=[identifier_field], 
-                                                select=[identifier_field, title_field, content_field], 
+                                                select=select, 
                                                 top=len(sources), 
                                                 query_type="full")
     
     # If your index has a key field that's filterable but not searchable and with the keyword analyzer, you can 
     # use a filter instead (and you can remove the regex check above, just ensure you escape single quotes)
-    # search_results = await search_client.search(filter=f"search.in(chunk_id, '{list}')", select=["chunk_id", "title", "chunk"])
+    # search_results = await search_client.search(filter=f"search.in(chunk_id, '{search_text}')", select=["chunk_id", "title", "chunk"])
 
     docs = []
     async for r in search_results:
@@ -108,13 +273,18 @@ def attach_rag_tools(rtmt: RTMiddleTier,
     content_field: str,
     embedding_field: str,
     title_field: str,
-    use_vector_query: bool
+    use_vector_query: bool,
+    semantic_cache: Optional[SemanticCache] = None
     ) -> None:
     # Get Azure client for search engine
     if not isinstance(credentials, AzureKeyCredential):
         credentials.get_token("https://search.azure.com/.default") # warm this up before we start getting requests
     search_client = SearchClient(search_endpoint, search_index, credentials, user_agent="RTMiddleTier")
 
+    # Fields to retrieve never change, build them once instead of on every tool call
+    search_select = ", ".join([identifier_field, content_field])
+    grounding_select = [identifier_field, title_field, content_field]
+
     # Add available tools for RealTime middletier
-    rtmt.tools["search"] = Tool(schema=_search_tool_schema, target=lambda args: _search_tool(search_client, semantic_configuration, identifier_field, content_field, embedding_field, use_vector_query, args))
-    rtmt.tools["report_grounding"] = Tool(schema=_grounding_tool_schema, target=lambda args: _report_grounding_tool(search_client, identifier_field, title_field, content_field, args))
+    rtmt.tools["search"] = Tool(schema=_search_tool_schema, target=lambda args: _search_tool(search_client, semantic_configuration, identifier_field, content_field, search_select, embedding_field, use_vector_query, semantic_cache, args))
+    rtmt.tools["report_grounding"] = Tool(schema=_grounding_tool_schema, target=lambda args: _report_grounding_tool(search_client, identifier_field, title_field, content_field, grounding_select, args))
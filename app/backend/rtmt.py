@@ -1,16 +1,43 @@
 import asyncio
-import json
+import contextlib
 import logging
+import random
+import time
+from collections.abc import Awaitable
 from enum import Enum
 from typing import Any, Callable, Optional
 
 import aiohttp
+import orjson
 from aiohttp import web
-from azure.core.credentials import AzureKeyCredential
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from azure.core.credentials import AccessToken, AzureKeyCredential
+from azure.identity import DefaultAzureCredential
 
 logger = logging.getLogger("voicerag")
 
+_TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+async def _send_text(ws: web.WebSocketResponse | aiohttp.ClientWebSocketResponse, data: str | bytes) -> None:
+    # orjson output is already UTF-8, send it as a text frame as is instead of round-tripping through str
+    if isinstance(data, bytes):
+        await ws.send_frame(data, aiohttp.WSMsgType.TEXT)
+    else:
+        await ws.send_str(data)
+
+# Quoted event types handled in _process_message_to_client, frames containing none of them are forwarded untouched
+_CLIENT_MESSAGE_PROBES = (
+    '"session.created"',
+    '"response.output_item.',
+    '"conversation.item.created"',
+    '"response.function_call_arguments.',
+    '"response.done"'
+)
+
+# Quoted event types handled in _process_message_to_server, the same fast path for client frames
+_SERVER_MESSAGE_PROBES = (
+    '"session.update"',
+)
+
 class ToolResultDirection(Enum):
     TO_SERVER = 1
     TO_CLIENT = 2
@@ -26,7 +53,7 @@ class ToolResult:
     def to_text(self) -> str:
         if self.text is None:
             return ""
-        return self.text if type(self.text) == str else json.dumps(self.text)
+        return self.text if type(self.text) == str else orjson.dumps(self.text).decode()
 
 class Tool:
     """Abstraction of a Tool necessary for a function call"""
@@ -59,7 +86,7 @@ class RTMiddleTier:
     
     # Tools are server-side only for now, though the case could be made for client-side tools
     # in addition to server-side tools that are invisible to the client
-    tools: dict[str, Tool] = {}
+    tools: dict[str, Tool]
 
     # Server-enforced configuration, if set, these will override the client's configuration
     # Typically at least the model name and system message will be set by the server
@@ -70,14 +97,57 @@ class RTMiddleTier:
     disable_audio: Optional[bool] = None
     voice_choice: Optional[str] = None
     api_version: str = "2024-10-01-preview"
-    _tools_pending = {}
-    _token_provider = None
+    _credentials: Optional[DefaultAzureCredential] = None
+    # Bearer token kept fresh in the background so connecting never blocks on AAD
+    _token_cache: Optional[AccessToken] = None
+    _token_refresh_task: Optional[asyncio.Task] = None
+    token_refresh_margin: float = 5 * 60 # Seconds before expiry when a new token is fetched
+    # Long-lived session shared across clients, if None a new one is opened for each client connection
+    session: Optional[aiohttp.ClientSession] = None
+    # Upstream realtime connections opened ahead of time, only used with a shared session
+    num_prewarm: int = 3
+    # Seconds, nothing reads pooled sockets so a dropped one isn't noticed, keep them well below
+    # typical idle timeouts and hand out sessions with almost all of their lifetime left
+    prewarm_max_age: float = 90
+    _ws_pool: asyncio.Queue
+    _ws_pool_task: Optional[asyncio.Task] = None
+    _ws_closing: set[asyncio.Task]
+    # Tool configuration sent in every session.update, fixed once attached to the app
+    _tool_schemas: list[Any]
+    _tool_choice: str
+    _tool_semaphore: asyncio.Semaphore
+    # Seconds a tool call may run before the model is told no result is available
+    tool_timeout: float
+    _client_message_handlers: dict[str, Callable[..., Awaitable[Optional[str | bytes]]]]
+    _server_message_handlers: dict[str, Callable[..., Awaitable[Optional[str | bytes]]]]
 
-    def __init__(self, endpoint: str, deployment: str, credentials: AzureKeyCredential | DefaultAzureCredential, voice_choice: Optional[str] = None):
+    def __init__(self, endpoint: str, deployment: str, credentials: AzureKeyCredential | DefaultAzureCredential, voice_choice: Optional[str] = None, session: Optional[aiohttp.ClientSession] = None, tool_concurrency: int = 16, tool_timeout: float = 8):
         # Set variables
         self.endpoint = endpoint
         self.deployment = deployment
         self.voice_choice = voice_choice
+        self.session = session
+        self.tools = {}
+        self._ws_pool = asyncio.Queue()
+        self._ws_closing = set()
+        self._tool_schemas = []
+        self._tool_choice = "none"
+        # Cap tool calls running at once across all sessions, so bursts queue here instead of overloading the backends
+        self._tool_semaphore = asyncio.Semaphore(tool_concurrency)
+        self.tool_timeout = tool_timeout
+        # Per-frame dispatch by message type, handlers return the message to forward or None to drop it
+        self._client_message_handlers = {
+            "session.created": self._on_session_created,
+            "response.output_item.added": self._on_output_item_added,
+            "conversation.item.created": self._on_conversation_item_created,
+            "response.function_call_arguments.delta": self._on_function_call_arguments,
+            "response.function_call_arguments.done": self._on_function_call_arguments,
+            "response.output_item.done": self._on_output_item_done,
+            "response.done": self._on_response_done
+        }
+        self._server_message_handlers = {
+            "session.update": self._on_session_update
+        }
         if voice_choice is not None:
             logger.info("Realtime voice choice set to %s", voice_choice)
             
@@ -85,155 +155,247 @@ class RTMiddleTier:
         if isinstance(credentials, AzureKeyCredential):
             self.key = credentials.key
         else:
-            self._token_provider = get_bearer_token_provider(credentials, "https://cognitiveservices.azure.com/.default")
-            self._token_provider() # Warm up during startup so we have a token cached when the first request arrives
+            self._credentials = credentials
+            self._token_cache = credentials.get_token(_TOKEN_SCOPE) # Warm up during startup so we have a token cached when the first request arrives
+
+    # Hide all informations 'cause reasons 
+    async def _on_session_created(self, message: dict, data: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse, tools_pending: dict[str, RTToolCall]) -> Optional[str | bytes]:
+        session = message["session"]
+        # Hide the instructions, tools and max tokens from clients, if we ever allow client-side 
+        # tools, this will need updating
+        session["instructions"] = ""
+        session["tools"] = []
+        session["voice"] = self.voice_choice
+        session["tool_choice"] = "none"
+        session["max_response_output_tokens"] = None
+        return orjson.dumps(message)
+
+    # Do not propagate messages about function_calling
+    async def _on_output_item_added(self, message: dict, data: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse, tools_pending: dict[str, RTToolCall]) -> Optional[str | bytes]:
+        if "item" in message and message["item"]["type"] == "function_call":
+            return None
+        return data
+
+    # Handle function_calls by creating a RTToolCall in the session's tools_pending 
+    async def _on_conversation_item_created(self, message: dict, data: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse, tools_pending: dict[str, RTToolCall]) -> Optional[str | bytes]:
+        # OpenAI want to call a function so create a RTToolCall in tools_pending 
+        if "item" in message and message["item"]["type"] == "function_call":
+            item = message["item"]
+            if item["call_id"] not in tools_pending:
+                # Now exists { "call_id" : RTToolCall }
+                tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message["previous_item_id"])
+            return None
+        # Hide middletier actions by obscuring the fact that openAI acknowledge the function call
+        elif "item" in message and message["item"]["type"] == "function_call_output":
+            return None
+        return data
+
+    # Do not propagate messages about function_calling
+    async def _on_function_call_arguments(self, message: dict, data: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse, tools_pending: dict[str, RTToolCall]) -> Optional[str | bytes]:
+        return None
+
+    async def _run_tool(self, tool: Tool, args: Any) -> ToolResult:
+        async with self._tool_semaphore:
+            return await tool.target(args)
+
+    # Wait for complete creation of response item
+    async def _on_output_item_done(self, message: dict, data: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse, tools_pending: dict[str, RTToolCall]) -> Optional[str | bytes]:
+        # OpenAI decided to call a function
+        if "item" in message and message["item"]["type"] == "function_call":
+            # Understand which one 
+            item = message["item"]
+            tool_call = tools_pending[message["item"]["call_id"]] # RTToolCall
+            tool = self.tools[item["name"]] # Tool
+            # Understand with which arg
+            args = item["arguments"]
+            # Call it
+            try:
+                # The timeout covers waiting for a free tool slot too, not just the call itself
+                result = await asyncio.wait_for(self._run_tool(tool, orjson.loads(args)), timeout=self.tool_timeout)
+            except asyncio.TimeoutError:
+                # Don't stall the conversation on a hung backend, let the model answer without the tool
+                logger.warning("Tool %s timed out after %s seconds", item["name"], self.tool_timeout)
+                result = ToolResult("The tool did not respond in time, no results are available.", ToolResultDirection.TO_SERVER)
+            # Forward result to the right endpoint
+            await _send_text(server_ws, orjson.dumps({
+                "type": "conversation.item.create",
+                "item": {
+                    "type": "function_call_output",
+                    "call_id": item["call_id"],
+                    "output": result.to_text() if result.destination == ToolResultDirection.TO_SERVER else ""
+                }
+            }))
+            if result.destination == ToolResultDirection.TO_CLIENT:
+                # TODO: this will break clients that don't know about this extra message, rewrite 
+                # this to be a regular text message with a special marker of some sort
+                await _send_text(client_ws, orjson.dumps({
+                    "type": "extension.middle_tier_tool_response",
+                    "previous_item_id": tool_call.previous_id,
+                    "tool_name": item["name"],
+                    "tool_result": result.to_text()
+                }))
+            return None
+        return data
+
+    async def _on_response_done(self, message: dict, data: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse, tools_pending: dict[str, RTToolCall]) -> Optional[str | bytes]:
+        # Tool calls of this response have been answered, only drop those so interleaved responses keep theirs
+        outputs = message["response"]["output"] if "response" in message else []
+        completed_calls = [tools_pending.pop(output.get("call_id"), None) for output in outputs if output["type"] == "function_call"]
+        if any(call is not None for call in completed_calls):
+            await _send_text(server_ws, orjson.dumps({
+                "type": "response.create"
+            }))
+        if "response" in message:
+            # Hide function calls from the client, single pass instead of popping while iterating
+            filtered_outputs = [output for output in outputs if output["type"] != "function_call"]
+            if len(filtered_outputs) != len(outputs):
+                message["response"]["output"] = filtered_outputs
+                return orjson.dumps(message)
+        return data
 
     # Handle function calling
-    async def _process_message_to_client(self, msg: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse) -> Optional[str]:
+    async def _process_message_to_client(self, msg: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse, tools_pending: dict[str, RTToolCall]) -> Optional[str | bytes]:
+        # Skip parsing for the bulk of the stream (audio, text and transcript deltas) which is never modified
+        if not any(probe in msg.data for probe in _CLIENT_MESSAGE_PROBES):
+            return msg.data
         # Format message incoming from openAI Server as json
-        message = json.loads(msg.data)
-        updated_message = msg.data
+        message = orjson.loads(msg.data)
+        if message is None:
+            return msg.data
         # Handle messages based on type 
-        if message is not None:
-            match message["type"]:
-                # Hide all informations 'cause reasons 
-                case "session.created":
-                    session = message["session"]
-                    # Hide the instructions, tools and max tokens from clients, if we ever allow client-side 
-                    # tools, this will need updating
-                    session["instructions"] = ""
-                    session["tools"] = []
-                    session["voice"] = self.voice_choice
-                    session["tool_choice"] = "none"
-                    session["max_response_output_tokens"] = None
-                    updated_message = json.dumps(message)
-
-                # Do not propagate messages about function_calling
-                case "response.output_item.added":
-                    if "item" in message and message["item"]["type"] == "function_call":
-                        updated_message = None
-                
-                # Handle function_calls by creating a RTToolCall in self._tools_pending 
-                case "conversation.item.created":
-                    # OpenAI want to call a function so create a RTToolCall in self._tools_pending 
-                    if "item" in message and message["item"]["type"] == "function_call":
-                        item = message["item"]
-                        if item["call_id"] not in self._tools_pending:
-                            # Now exists { "call_id" : RTToolCall }
-                            self._tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message["previous_item_id"])
-                        updated_message = None
-                        
-                    # Hide middletier actions by obscuring the fact that openAI acknowledge the function call
-                    elif "item" in message and message["item"]["type"] == "function_call_output":
-                        updated_message = None
-                        
-                # Do not propagate messages about function_calling  
-                case "response.function_call_arguments.delta":
-                    updated_message = None
-                
-                # Do not propagate messages about function_calling
-                case "response.function_call_arguments.done":
-                    updated_message = None
-
-                # Wait for complete creation of response item
-                case "response.output_item.done":
-                    # OpenAI decided to call a function
-                    if "item" in message and message["item"]["type"] == "function_call":
-                        # Understand which one 
-                        item = message["item"]
-                        tool_call = self._tools_pending[message["item"]["call_id"]] # RTToolCall
-                        tool = self.tools[item["name"]] # Tool
-                        # Understand with which arg
-                        args = item["arguments"]
-                        # Call it
-                        result = await tool.target(json.loads(args))
-                        # Forward result to the right endpoint
-                        await server_ws.send_json({
-                            "type": "conversation.item.create",
-                            "item": {
-                                "type": "function_call_output",
-                                "call_id": item["call_id"],
-                                "output": result.to_text() if result.destination == ToolResultDirection.TO_SERVER else ""
-                            }
-                        })
-                        if result.destination == ToolResultDirection.TO_CLIENT:
-                            # TODO: this will break clients that don't know about this extra message, rewrite 
-                            # this to be a regular text message with a special marker of some sort
-                            await client_ws.send_json({
-                                "type": "extension.middle_tier_tool_response",
-                                "previous_item_id": tool_call.previous_id,
-                                "tool_name": item["name"],
-                                "tool_result": result.to_text()
-                            })
-                        updated_message = None
-
-                case "response.done":
-                    if len(self._tools_pending) > 0:
-                        self._tools_pending.clear() # Any chance tool calls could be interleaved across different outstanding responses?
-                        await server_ws.send_json({
-                            "type": "response.create"
-                        })
-                    if "response" in message:
-                        replace = False
-                        for i, output in enumerate(reversed(message["response"]["output"])):
-                            if output["type"] == "function_call":
-                                message["response"]["output"].pop(i)
-                                replace = True
-                        if replace:
-                            updated_message = json.dumps(message)                        
-
-        return updated_message
-    
+        handler = self._client_message_handlers.get(message["type"])
+        if handler is None:
+            return msg.data
+        return await handler(message, msg.data, client_ws, server_ws, tools_pending)
+
+    # Handle only "session.update" message type
+    async def _on_session_update(self, message: dict, data: str, ws: web.WebSocketResponse) -> Optional[str | bytes]:
+        # Set up session with defined variables
+        session = message["session"]
+        if self.system_message is not None:
+            session["instructions"] = self.system_message
+        if self.temperature is not None:
+            session["temperature"] = self.temperature
+        if self.max_tokens is not None:
+            session["max_response_output_tokens"] = self.max_tokens
+        if self.disable_audio is not None:
+            session["disable_audio"] = self.disable_audio
+        if self.voice_choice is not None:
+            session["voice"] = self.voice_choice
+            
+        # Define tools available by OpenAI model
+        session["tool_choice"] = self._tool_choice
+        session["tools"] = self._tool_schemas
+        
+        # Update message and forward it
+        return orjson.dumps(message)
+
     # Intercept session.update messages, overide the variables and set tools
-    async def _process_message_to_server(self, msg: str, ws: web.WebSocketResponse) -> Optional[str]:
+    async def _process_message_to_server(self, msg: str, ws: web.WebSocketResponse) -> Optional[str | bytes]:
         
+        # Forward the bulk of the stream (input audio appends) as received, without parsing or re-encoding
+        if not any(probe in msg.data for probe in _SERVER_MESSAGE_PROBES):
+            return msg.data
         # Format messages incoming from application client as json
-        message = json.loads(msg.data)
-        updated_message = msg.data
+        message = orjson.loads(msg.data)
+        if message is None:
+            return msg.data
         
         # Handle messages based on type 
-        if message is not None:
-            match message["type"]:
-                # Handle only "session.update" message type
-                case "session.update":
-                    # Set up session with defined variables
-                    session = message["session"]
-                    if self.system_message is not None:
-                        session["instructions"] = self.system_message
-                    if self.temperature is not None:
-                        session["temperature"] = self.temperature
-                    if self.max_tokens is not None:
-                        session["max_response_output_tokens"] = self.max_tokens
-                    if self.disable_audio is not None:
-                        session["disable_audio"] = self.disable_audio
-                    if self.voice_choice is not None:
-                        session["voice"] = self.voice_choice
-                        
-                    # Define tools available by OpenAI model
-                    session["tool_choice"] = "auto" if len(self.tools) > 0 else "none"
-                    session["tools"] = [tool.schema for tool in self.tools.values()]
-                    
-                    # Update message and forward it
-                    updated_message = json.dumps(message)
-        
-        return updated_message
+        handler = self._server_message_handlers.get(message["type"])
+        if handler is None:
+            return msg.data
+        return await handler(message, msg.data, ws)
+
+    # Read the token refreshed in the background, only fetch one synchronously if it's missing or about to expire
+    def _bearer_token(self) -> str:
+        if self._token_cache is None or self._token_cache.expires_on - time.time() < 60:
+            self._token_cache = self._credentials.get_token(_TOKEN_SCOPE)
+        return self._token_cache.token
+
+    # No async version of the credential, so fetch a new token in a worker thread shortly before the current one expires
+    async def _refresh_token_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            remaining = self._token_cache.expires_on - time.time() if self._token_cache is not None else 0
+            # Never spin, even if the credential hands back a token that is already close to expiry
+            await asyncio.sleep(max(remaining - self.token_refresh_margin, 30))
+            try:
+                self._token_cache = await loop.run_in_executor(None, self._credentials.get_token, _TOKEN_SCOPE)
+            except Exception:
+                logger.warning("Could not refresh the Azure OpenAI token, retrying", exc_info=True)
+
+    # Define headers for Azure OpenAI API
+    def _upstream_headers(self, ws: Optional[web.WebSocketResponse] = None) -> dict[str, str]:
+        request_id_header = {}
+        if ws is not None and "x-ms-client-request-id" in ws.headers:
+            request_id_header["x-ms-client-request-id"] = ws.headers["x-ms-client-request-id"]
+        return {**request_id_header, **self.auth_headers()}
+
+    # Authentication headers for Azure OpenAI, from the key or the token refreshed in the background
+    def auth_headers(self) -> dict[str, str]:
+        if self.key is not None:
+            return { "api-key": self.key }
+        return { "Authorization": f"Bearer {self._bearer_token()}" }
+
+    # Connect with "/openai/realtime" via websocket connection
+    async def _connect_upstream(self, session: aiohttp.ClientSession, headers: dict[str, str]) -> aiohttp.ClientWebSocketResponse:
+        params = { "api-version": self.api_version, "deployment": self.deployment}
+        # Negotiate permessage-deflate, the JSON event stream compresses well, and don't cap large events
+        return await session.ws_connect("/openai/realtime", headers=headers, params=params, compress=15, max_msg_size=0)
+
+    # Keep the pool filled with ready upstream connections, dropping the ones that got old or closed
+    async def _replenish_ws_pool(self):
+        while True:
+            # Nothing is awaited while draining, so a client checking out concurrently can't empty the queue under us
+            fresh = []
+            while not self._ws_pool.empty():
+                target_ws, expires_at = self._ws_pool.get_nowait()
+                if target_ws.closed or time.monotonic() >= expires_at:
+                    self._close_in_background(target_ws)
+                else:
+                    fresh.append((target_ws, expires_at))
+            for entry in fresh:
+                self._ws_pool.put_nowait(entry)
+            if self._ws_pool.qsize() >= self.num_prewarm:
+                await asyncio.sleep(5)
+                continue
+            try:
+                target_ws = await self._connect_upstream(self.session, self._upstream_headers())
+            except Exception:
+                # Includes credential errors from the token fallback, the pool must keep retrying rather than die
+                logger.warning("Could not pre-connect to the realtime endpoint, retrying", exc_info=True)
+                await asyncio.sleep(5)
+                continue
+            # Jitter the expiry so pooled connections don't all reconnect at once
+            self._ws_pool.put_nowait((target_ws, time.monotonic() + self.prewarm_max_age * random.uniform(0.75, 1.0)))
+
+    # Close a stale pooled connection without blocking the caller on the close handshake
+    def _close_in_background(self, target_ws: aiohttp.ClientWebSocketResponse):
+        task = asyncio.create_task(target_ws.close())
+        self._ws_closing.add(task)
+        task.add_done_callback(self._ws_closing.discard)
+
+    # Take a pre-connected upstream connection if one is ready, otherwise open a new one
+    async def _checkout_upstream(self, session: aiohttp.ClientSession, ws: web.WebSocketResponse) -> aiohttp.ClientWebSocketResponse:
+        if session is self.session:
+            while not self._ws_pool.empty():
+                target_ws, expires_at = self._ws_pool.get_nowait()
+                if not target_ws.closed and time.monotonic() < expires_at:
+                    return target_ws
+                # Don't make the client wait on the close handshake of a stale connection
+                self._close_in_background(target_ws)
+        return await self._connect_upstream(session, self._upstream_headers(ws))
 
     # Handle all the messages as a middletier router
     async def _forward_messages(self, ws: web.WebSocketResponse):
         # Now the backend becomes a client for the OpenAI server and contacts it via RealtimeAPI
-        async with aiohttp.ClientSession(base_url=self.endpoint) as session:
-            # Define headers and param for Azure OpenAI API
-            params = { "api-version": self.api_version, "deployment": self.deployment}
-            headers = {}
-            if "x-ms-client-request-id" in ws.headers:
-                headers["x-ms-client-request-id"] = ws.headers["x-ms-client-request-id"]
-            if self.key is not None:
-                headers = { "api-key": self.key }
-            else:
-                headers = { "Authorization": f"Bearer {self._token_provider()}" } # NOTE: no async version of token provider, maybe refresh token on a timer?
-            
-            # Connect with "/openai/realtime" via websocket connection
-            async with session.ws_connect("/openai/realtime", headers=headers, params=params) as target_ws:
+        # Reuse the shared session when available for its DNS cache, an upgraded websocket connection never returns
+        # to the pool so each new upstream socket still pays the TCP+TLS handshake (the pre-connected pool hides it)
+        async with (contextlib.nullcontext(self.session) if self.session is not None else aiohttp.ClientSession(base_url=self.endpoint)) as session:
+            async with await self._checkout_upstream(session, ws) as target_ws:
+                # Function calls awaiting completion, scoped to this client so sessions never see each other's calls
+                tools_pending: dict[str, RTToolCall] = {}
                 
                 # How rtmt handle messages to send to OpenAI
                 async def from_client_to_server():
@@ -244,13 +406,13 @@ class RTMiddleTier:
                             new_msg = await self._process_message_to_server(msg, ws)
                             if new_msg is not None:
                                 # Send it to OpenAI Server
-                                await target_ws.send_str(new_msg)
+                                await _send_text(target_ws, new_msg)
                         else:
-                            print("Error: unexpected message type:", msg.type)
+                            logger.warning("Unexpected message type: %s", msg.type)
                     
                     # Means it is gracefully closed by the client then time to close the target_ws
                     if target_ws:
-                        print("Closing OpenAI's realtime socket connection.")
+                        logger.info("Closing OpenAI's realtime socket connection.")
                         await target_ws.close()
                 
                 # How rtmt handle messages recived from OpenAI        
@@ -259,17 +421,24 @@ class RTMiddleTier:
                     async for msg in target_ws:
                         if msg.type == aiohttp.WSMsgType.TEXT:
                             # Process it accordingly
-                            new_msg = await self._process_message_to_client(msg, ws, target_ws)
+                            new_msg = await self._process_message_to_client(msg, ws, target_ws, tools_pending)
                             if new_msg is not None:
                                 # Send it to application Client
-                                await ws.send_str(new_msg)
+                                await _send_text(ws, new_msg)
                         else:
-                            print("Error: unexpected message type:", msg.type)
+                            logger.warning("Unexpected message type: %s", msg.type)
+
+                    # Means OpenAI closed the session then stop waiting on the client as well
+                    if not ws.closed:
+                        await ws.close()
 
                 try:
                     # Perform async routines a.k.a. handle all the messages as a middletier router
-                    await asyncio.gather(from_client_to_server(), from_server_to_client())
-                except ConnectionResetError:
+                    # If either direction fails the other one is cancelled rather than left running
+                    async with asyncio.TaskGroup() as tg:
+                        tg.create_task(from_client_to_server())
+                        tg.create_task(from_server_to_client())
+                except* ConnectionResetError:
                     # Ignore the errors resulting from the client disconnecting the socket
                     pass
             
@@ -282,6 +451,40 @@ class RTMiddleTier:
         await self._forward_messages(ws)
         return ws
     
+    async def _start_token_refresh(self, app):
+        self._token_refresh_task = asyncio.create_task(self._refresh_token_loop())
+
+    async def _stop_token_refresh(self, app):
+        self._token_refresh_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._token_refresh_task
+
+    async def _start_ws_pool(self, app):
+        self._ws_pool_task = asyncio.create_task(self._replenish_ws_pool())
+
+    async def _stop_ws_pool(self, app):
+        self._ws_pool_task.cancel()
+        try:
+            await self._ws_pool_task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # The task may have died before cleanup, the remaining sockets and sessions still have to be closed
+            logger.warning("Realtime connection pool stopped with an error", exc_info=True)
+        while not self._ws_pool.empty():
+            target_ws, _ = self._ws_pool.get_nowait()
+            await target_ws.close()
+
     # When the App recieve a GET on "/realtime" invokes the rtmt _websoket_handler function
     def attach_to_app(self, app, path):
         app.router.add_get(path, self._websocket_handler)
+        # Tools are registered before attaching, build their configuration once instead of per session
+        self._tool_schemas = [tool.schema for tool in self.tools.values()]
+        self._tool_choice = "auto" if len(self._tool_schemas) > 0 else "none"
+        if self._credentials is not None:
+            app.on_startup.append(self._start_token_refresh)
+            app.on_cleanup.append(self._stop_token_refresh)
+        # Pre-connected upstream sockets need a session that outlives a single client
+        if self.session is not None and self.num_prewarm > 0:
+            app.on_startup.append(self._start_ws_pool)
+            app.on_cleanup.append(self._stop_ws_pool)